@@ -1,15 +1,19 @@
-from fastapi import FastAPI, APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
 import os
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, validator
 from typing import List, Optional
 import uuid
-from datetime import datetime
+import hashlib
+import orjson
+from datetime import datetime, timezone
 from enum import Enum
 
 
@@ -18,11 +22,26 @@ load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=50,
+    minPoolSize=10,
+    maxIdleTimeMS=60000,
+    serverSelectionTimeoutMS=3000,
+    uuidRepresentation="standard",
+    tz_aware=True,
+)
 db = client[os.environ['DB_NAME']]
 
+# Opções do orjson: datetimes UTC saem com sufixo "Z", no mesmo formato do Pydantic
+ORJSON_OPTIONS = orjson.OPT_UTC_Z
+
+class APIJSONResponse(ORJSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
 # Create the main app without a prefix
-app = FastAPI(title="InstaGrow API", description="API para venda de seguidores do Instagram")
+app = FastAPI(default_response_class=APIJSONResponse, title="InstaGrow API", description="API para venda de seguidores do Instagram")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -41,8 +60,14 @@ class OrderStatus(str, Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+def utc_now() -> datetime:
+    """Data/hora atual em UTC, com timezone"""
+    return datetime.now(timezone.utc)
+
 # Models
 class Package(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     description: str
@@ -51,7 +76,7 @@ class Package(BaseModel):
     price: float
     delivery_time: str  # ex: "1-3 dias"
     popular: bool = False
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
 
 class PackageCreate(BaseModel):
     name: str
@@ -63,6 +88,8 @@ class PackageCreate(BaseModel):
     popular: bool = False
 
 class Order(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     customer_name: str
     customer_email: str
@@ -76,8 +103,8 @@ class Order(BaseModel):
     pix_code: Optional[str] = None
     pix_qr_code: Optional[str] = None
     payment_id: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-    updated_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
+    updated_at: datetime = Field(default_factory=utc_now)
 
 class OrderCreate(BaseModel):
     customer_name: str
@@ -97,25 +124,118 @@ class OrderCreate(BaseModel):
 class OrderUpdate(BaseModel):
     status: OrderStatus
 
+# Projeções do MongoDB: apenas os campos dos modelos, sem _id
+PACKAGE_PROJECTION = {"_id": 0, **{field: 1 for field in Package.model_fields}}
+ORDER_PROJECTION = {"_id": 0, **{field: 1 for field in Order.model_fields}}
+LIST_BATCH_SIZE = 200
+
+# Catálogo de pacotes em memória: carregado no startup e atualizado nas escritas.
+# Uma tarefa em segundo plano o recarrega periodicamente para limitar a defasagem entre workers.
+PACKAGES_REFRESH_INTERVAL = 60  # segundos
+_packages = {}
+_packages_json = None
+_packages_lock = asyncio.Lock()
+_packages_pending_changes = None  # alterações feitas durante um recarregamento em andamento
+_packages_refresh_task = None
+
+async def load_packages():
+    """Recarrega o catálogo de pacotes do banco para a memória"""
+    global _packages, _packages_pending_changes
+    async with _packages_lock:
+        _packages_pending_changes = []
+        try:
+            packages = {}
+            cursor = db.packages.find({}, projection=PACKAGE_PROJECTION).limit(1000).batch_size(LIST_BATCH_SIZE)
+            async for package in cursor:
+                packages[package["id"]] = package
+        finally:
+            changes, _packages_pending_changes = _packages_pending_changes, None
+        # Reaplica as escritas que podem ter chegado depois da leitura do cursor
+        for package_id, package in changes:
+            if package is None:
+                packages.pop(package_id, None)
+            else:
+                packages[package_id] = package
+        _packages = packages
+        invalidate_packages_cache()
+
+async def refresh_packages():
+    """Recarrega o catálogo, mantendo a versão atual se o banco falhar"""
+    try:
+        await load_packages()
+    except Exception:
+        logger.exception("Falha ao recarregar o catálogo de pacotes; mantendo a versão em memória")
+
+async def refresh_packages_periodically():
+    """Recarrega o catálogo a cada intervalo"""
+    while True:
+        await asyncio.sleep(PACKAGES_REFRESH_INTERVAL)
+        await refresh_packages()
+
+def update_catalog(package_id: str, package: Optional[dict]):
+    """Aplica uma escrita ao catálogo em memória (None remove o pacote)"""
+    if package is None:
+        _packages.pop(package_id, None)
+    else:
+        _packages[package_id] = package
+    if _packages_pending_changes is not None:
+        _packages_pending_changes.append((package_id, package))
+    invalidate_packages_cache()
+
+async def find_package(package_id: str):
+    """Busca um pacote no catálogo em memória, consultando o banco se não estiver lá"""
+    package = _packages.get(package_id)
+    if package is None:
+        package = await db.packages.find_one({"id": package_id}, projection=PACKAGE_PROJECTION)
+    return package
+
+def invalidate_packages_cache():
+    """Descarta o JSON pré-serializado após qualquer alteração no catálogo"""
+    global _packages_json
+    _packages_json = None
+
+def get_packages_json():
+    """Retorna (json, etag) da listagem de pacotes, serializando só após alterações"""
+    global _packages_json
+    if _packages_json is None:
+        content = orjson.dumps(list(_packages.values()), option=ORJSON_OPTIONS)
+        etag = '"' + hashlib.blake2b(content, digest_size=8).hexdigest() + '"'
+        _packages_json = (content, etag)
+    return _packages_json
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Verifica se o ETag enviado em If-None-Match corresponde ao atual"""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in tags or "*" in tags
+
 # Utility functions
+# Trechos fixos do payload PIX
+_PIX_PREFIX = "00020126580014BR.GOV.BCB.PIX013636"
+_PIX_MERCHANT_INFO = "5204000053039865802BR5925"
+_PIX_SUFFIX = "62070503***6304"
+
 def generate_pix_code(value: float, name: str, city: str = "São Paulo") -> str:
     """Gera código PIX simplificado (em produção usar gateway de pagamento real)"""
-    import uuid
-    payment_id = str(uuid.uuid4())[:8]
+    payment_id = uuid.uuid4().hex[:8]
     # Em produção, integrar com gateway como Mercado Pago, PagSeguro, etc.
-    return f"00020126580014BR.GOV.BCB.PIX013636{payment_id}5204000053039865802BR5925{name[:25]}6009{city[:15]}62070503***6304"
+    return f"{_PIX_PREFIX}{payment_id}{_PIX_MERCHANT_INFO}{name[:25]}6009{city[:15]}{_PIX_SUFFIX}"
 
 def generate_qr_code(pix_code: str) -> str:
     """Gera QR code do PIX (versão simplificada)"""
     # Em produção, gerar QR code real usando biblioteca apropriada
     return f"data:text/plain;base64,{pix_code}"
 
+cors_origins = tuple(origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(',') if origin.strip())
 app.add_middleware(
     CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Com "*" não há credenciais: o middleware responde o cabeçalho fixo em vez de ecoar a origem
+    allow_credentials="*" not in cors_origins,
+    allow_origins=cors_origins,
+    allow_methods=("GET", "POST", "PUT", "DELETE", "OPTIONS"),
+    allow_headers=("*",),
 )
 
 # Configure logging
@@ -134,15 +254,18 @@ async def root():
 
 # Package routes
 @api_router.get("/packages", response_model=List[Package])
-async def get_packages():
+async def get_packages(request: Request):
     """Lista todos os pacotes disponíveis"""
-    packages = await db.packages.find().to_list(1000)
-    return [Package(**package) for package in packages]
+    content, etag = get_packages_json()
+    headers = {"ETag": etag}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
 
 @api_router.get("/packages/{package_id}", response_model=Package)
 async def get_package(package_id: str):
     """Obtém um pacote específico"""
-    package = await db.packages.find_one({"id": package_id})
+    package = await find_package(package_id)
     if not package:
         raise HTTPException(status_code=404, detail="Pacote não encontrado")
     return Package(**package)
@@ -150,22 +273,37 @@ async def get_package(package_id: str):
 @api_router.post("/packages", response_model=Package)
 async def create_package(package: PackageCreate):
     """Cria um novo pacote (admin)"""
-    package_dict = package.dict()
-    package_obj = Package(**package_dict)
-    await db.packages.insert_one(package_obj.dict())
+    package_obj = Package(**package.model_dump())
+    package_doc = package_obj.model_dump()
+    await db.packages.insert_one(package_doc)
+    package_doc.pop("_id", None)
+    update_catalog(package_obj.id, package_doc)
     return package_obj
 
 @api_router.put("/packages/{package_id}", response_model=Package)
 async def update_package(package_id: str, package: PackageCreate):
     """Atualiza um pacote (admin)"""
-    result = await db.packages.find_one_and_update(
-        {"id": package_id},
-        {"$set": package.dict()},
-        return_document=True
-    )
-    if not result:
-        raise HTTPException(status_code=404, detail="Pacote não encontrado")
-    return Package(**result)
+    update_dict = package.model_dump()
+    current = _packages.get(package_id)
+    if current is None:
+        # Fora do catálogo em memória: atualiza e lê o documento numa única operação
+        updated = await db.packages.find_one_and_update(
+            {"id": package_id},
+            {"$set": update_dict},
+            projection=PACKAGE_PROJECTION,
+            return_document=True
+        )
+        if not updated:
+            raise HTTPException(status_code=404, detail="Pacote não encontrado")
+    else:
+        # Monta a resposta a partir do catálogo em memória, sem reler o documento
+        result = await db.packages.update_one({"id": package_id}, {"$set": update_dict})
+        if result.matched_count == 0:
+            update_catalog(package_id, None)
+            raise HTTPException(status_code=404, detail="Pacote não encontrado")
+        updated = {**current, **update_dict}
+    update_catalog(package_id, updated)
+    return Package.model_construct(**updated)
 
 @api_router.delete("/packages/{package_id}")
 async def delete_package(package_id: str):
@@ -173,14 +311,16 @@ async def delete_package(package_id: str):
     result = await db.packages.delete_one({"id": package_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Pacote não encontrado")
+    update_catalog(package_id, None)
     return {"message": "Pacote removido com sucesso"}
 
 # Order routes
 @api_router.post("/orders", response_model=Order)
 async def create_order(order_data: OrderCreate):
     """Cria um novo pedido"""
-    # Busca o pacote
-    package = await db.packages.find_one({"id": order_data.package_id})
+    # Busca o pacote no banco: preço e existência não podem vir do catálogo em memória,
+    # que pode estar defasado em relação a outros workers
+    package = await db.packages.find_one({"id": order_data.package_id}, projection=PACKAGE_PROJECTION)
     if not package:
         raise HTTPException(status_code=404, detail="Pacote não encontrado")
     
@@ -189,25 +329,29 @@ async def create_order(order_data: OrderCreate):
     qr_code = generate_qr_code(pix_code)
     
     # Cria o pedido
-    order_dict = order_data.dict()
-    order_dict.update({
+    now = utc_now()
+    order_obj = Order(**{
+        **order_data.model_dump(),
         "package_name": package["name"],
         "package_quantity": package["quantity"],
         "package_price": package["price"],
         "pix_code": pix_code,
         "pix_qr_code": qr_code,
-        "payment_id": str(uuid.uuid4())[:8]
+        "payment_id": uuid.uuid4().hex[:8],
+        "created_at": now,
+        "updated_at": now
     })
-    
-    order_obj = Order(**order_dict)
-    await db.orders.insert_one(order_obj.dict())
+    await db.orders.insert_one(order_obj.model_dump())
     return order_obj
 
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders():
     """Lista todos os pedidos (admin)"""
-    orders = await db.orders.find().sort("created_at", -1).to_list(1000)
-    return [Order(**order) for order in orders]
+    orders = []
+    cursor = db.orders.find({}, projection=ORDER_PROJECTION).sort("created_at", -1).limit(1000).batch_size(LIST_BATCH_SIZE)
+    async for order in cursor:
+        orders.append(order)
+    return APIJSONResponse(orders)
 
 @api_router.get("/orders/{order_id}", response_model=Order)
 async def get_order(order_id: str):
@@ -220,12 +364,13 @@ async def get_order(order_id: str):
 @api_router.put("/orders/{order_id}/status", response_model=Order)
 async def update_order_status(order_id: str, update_data: OrderUpdate):
     """Atualiza status do pedido (admin)"""
-    update_dict = update_data.dict()
-    update_dict["updated_at"] = datetime.utcnow()
+    update_dict = update_data.model_dump()
+    update_dict["updated_at"] = utc_now()
     
     result = await db.orders.find_one_and_update(
         {"id": order_id},
         {"$set": update_dict},
+        projection=ORDER_PROJECTION,
         return_document=True
     )
     if not result:
@@ -236,15 +381,24 @@ async def update_order_status(order_id: str, update_data: OrderUpdate):
 @api_router.get("/admin/stats")
 async def get_stats():
     """Estatísticas para o painel admin"""
-    total_orders = await db.orders.count_documents({})
-    pending_orders = await db.orders.count_documents({"status": "pending"})
-    completed_orders = await db.orders.count_documents({"status": "completed"})
-    total_revenue = await db.orders.aggregate([
-        {"$match": {"status": {"$in": ["paid", "processing", "completed"]}}},
-        {"$group": {"_id": None, "total": {"$sum": "$package_price"}}}
+    # Uma única agregação com $facet em vez de quatro consultas separadas
+    result = await db.orders.aggregate([
+        {"$facet": {
+            "total": [{"$count": "n"}],
+            "pending": [{"$match": {"status": "pending"}}, {"$count": "n"}],
+            "completed": [{"$match": {"status": "completed"}}, {"$count": "n"}],
+            "revenue": [
+                {"$match": {"status": {"$in": ["paid", "processing", "completed"]}}},
+                {"$group": {"_id": None, "total": {"$sum": "$package_price"}}}
+            ]
+        }}
     ]).to_list(1)
+    facets = result[0]
     
-    revenue = total_revenue[0]["total"] if total_revenue else 0
+    total_orders = facets["total"][0]["n"] if facets["total"] else 0
+    pending_orders = facets["pending"][0]["n"] if facets["pending"] else 0
+    completed_orders = facets["completed"][0]["n"] if facets["completed"] else 0
+    revenue = facets["revenue"][0]["total"] if facets["revenue"] else 0
     
     return {
         "total_orders": total_orders,
@@ -253,74 +407,107 @@ async def get_stats():
         "total_revenue": revenue
     }
 
+# Default packages, built once at import with deterministic ids so re-runs are idempotent
+_DEFAULT_PACKAGE_DATA = [
+    {
+        "name": "100 Seguidores",
+        "description": "Ideal para começar! 100 seguidores brasileiros de qualidade.",
+        "type": "followers",
+        "quantity": 100,
+        "price": 9.90,
+        "delivery_time": "1-2 horas",
+        "popular": False
+    },
+    {
+        "name": "500 Seguidores",
+        "description": "Mais popular! 500 seguidores brasileiros ativos.",
+        "type": "followers",
+        "quantity": 500,
+        "price": 29.90,
+        "delivery_time": "2-6 horas",
+        "popular": True
+    },
+    {
+        "name": "1.000 Seguidores",
+        "description": "Plano premium com 1.000 seguidores de alta qualidade.",
+        "type": "followers",
+        "quantity": 1000,
+        "price": 49.90,
+        "delivery_time": "6-12 horas",
+        "popular": False
+    },
+    {
+        "name": "2.500 Seguidores",
+        "description": "Para quem quer crescer rápido! 2.500 seguidores reais.",
+        "type": "followers",
+        "quantity": 2500,
+        "price": 99.90,
+        "delivery_time": "12-24 horas",
+        "popular": False
+    },
+    {
+        "name": "5.000 Seguidores",
+        "description": "Pacote profissional com 5.000 seguidores brasileiros.",
+        "type": "followers",
+        "quantity": 5000,
+        "price": 179.90,
+        "delivery_time": "24-48 horas",
+        "popular": False
+    }
+]
+
+_DEFAULT_PACKAGES = tuple(
+    Package(id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"instagrow/package/{pkg_data['name']}")), **pkg_data).model_dump()
+    for pkg_data in _DEFAULT_PACKAGE_DATA
+)
+
 # Initialize default packages
 @api_router.post("/init-data")
 async def initialize_data():
     """Inicializa dados padrão (executar apenas uma vez)"""
-    # Verifica se já existem pacotes
-    existing = await db.packages.count_documents({})
-    if existing > 0:
+    # Verifica se já existem pacotes (limit=1 evita contar a coleção inteira)
+    if await db.packages.count_documents({}, limit=1):
         return {"message": "Dados já inicializados"}
     
-    default_packages = [
-        {
-            "name": "100 Seguidores",
-            "description": "Ideal para começar! 100 seguidores brasileiros de qualidade.",
-            "type": "followers",
-            "quantity": 100,
-            "price": 9.90,
-            "delivery_time": "1-2 horas",
-            "popular": False
-        },
-        {
-            "name": "500 Seguidores",
-            "description": "Mais popular! 500 seguidores brasileiros ativos.",
-            "type": "followers",
-            "quantity": 500,
-            "price": 29.90,
-            "delivery_time": "2-6 horas",
-            "popular": True
-        },
-        {
-            "name": "1.000 Seguidores",
-            "description": "Plano premium com 1.000 seguidores de alta qualidade.",
-            "type": "followers",
-            "quantity": 1000,
-            "price": 49.90,
-            "delivery_time": "6-12 horas",
-            "popular": False
-        },
-        {
-            "name": "2.500 Seguidores",
-            "description": "Para quem quer crescer rápido! 2.500 seguidores reais.",
-            "type": "followers",
-            "quantity": 2500,
-            "price": 99.90,
-            "delivery_time": "12-24 horas",
-            "popular": False
-        },
-        {
-            "name": "5.000 Seguidores",
-            "description": "Pacote profissional com 5.000 seguidores brasileiros.",
-            "type": "followers",
-            "quantity": 5000,
-            "price": 179.90,
-            "delivery_time": "24-48 horas",
-            "popular": False
-        }
-    ]
-    
-    packages_to_insert = []
-    for pkg_data in default_packages:
-        pkg_obj = Package(**pkg_data)
-        packages_to_insert.append(pkg_obj.dict())
-    
-    await db.packages.insert_many(packages_to_insert)
-    return {"message": f"Inicializados {len(default_packages)} pacotes padrão"}
+    # Copia os documentos (insert_many acrescenta _id aos dicts) com a data da inserção
+    now = utc_now()
+    try:
+        await db.packages.insert_many([{**pkg, "created_at": now} for pkg in _DEFAULT_PACKAGES], ordered=False)
+    except BulkWriteError as e:
+        # Outra chamada concorrente já inseriu os pacotes (ids determinísticos + índice único)
+        write_errors = e.details.get("writeErrors", [])
+        only_duplicates = write_errors and all(error.get("code") == 11000 for error in write_errors)
+        if not only_duplicates or e.details.get("writeConcernErrors"):
+            raise
+        await load_packages()
+        return {"message": "Dados já inicializados"}
+    await load_packages()
+    return {"message": f"Inicializados {len(_DEFAULT_PACKAGES)} pacotes padrão"}
 
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.on_event("startup")
+async def warm_db_pool():
+    """Abre as conexões do pool antes da primeira requisição"""
+    await client.admin.command("ping")
+
+@app.on_event("startup")
+async def create_indexes():
+    """Cria os índices usados pelas consultas da API"""
+    await db.packages.create_index("id", unique=True)
+    await db.orders.create_index("id", unique=True)
+    await db.orders.create_index([("created_at", -1)])
+
+@app.on_event("startup")
+async def preload_packages():
+    """Carrega o catálogo de pacotes em memória e agenda o recarregamento periódico"""
+    global _packages_refresh_task
+    await load_packages()
+    _packages_refresh_task = asyncio.create_task(refresh_packages_periodically())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if _packages_refresh_task is not None:
+        _packages_refresh_task.cancel()
     client.close()
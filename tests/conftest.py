@@ -0,0 +1,40 @@
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from fastapi.testclient import TestClient  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def mock_db(monkeypatch):
+    """Substitui o MongoDB por um banco em memória e zera o estado do catálogo"""
+    mock_client = AsyncMongoMockClient(tz_aware=True)
+    db = mock_client["test_database"]
+    monkeypatch.setattr(server, "client", mock_client)
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "_packages", {})
+    monkeypatch.setattr(server, "_packages_json", None)
+    monkeypatch.setattr(server, "_packages_lock", asyncio.Lock())
+    return db
+
+
+@pytest.fixture
+def client(mock_db):
+    with TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def initialized_client(client):
+    client.post("/api/init-data")
+    return client
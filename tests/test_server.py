@@ -0,0 +1,209 @@
+import pytest
+from pymongo.errors import BulkWriteError
+
+import server
+
+NEW_PACKAGE = {
+    "name": "50 Curtidas",
+    "description": "Curtidas para um post.",
+    "type": "likes",
+    "quantity": 50,
+    "price": 4.90,
+    "delivery_time": "1 hora",
+}
+
+NEW_ORDER = {
+    "customer_name": "Ana",
+    "customer_email": "ana@example.com",
+    "customer_phone": "11999999999",
+    "instagram_username": "@ana",
+}
+
+
+def test_missing_package_returns_404(initialized_client):
+    assert initialized_client.get("/api/packages/missing").status_code == 404
+    assert initialized_client.delete("/api/packages/missing").status_code == 404
+    order = initialized_client.post("/api/orders", json={**NEW_ORDER, "package_id": "missing"})
+    assert order.status_code == 404
+    assert None not in initialized_client.get("/api/packages").json()
+
+
+def test_create_order_reads_package_from_database(initialized_client, mock_db):
+    packages = initialized_client.get("/api/packages").json()
+    # Simula escritas de outro worker que o catálogo em memória ainda não viu
+    initialized_client.portal.call(mock_db.packages.update_one, {"id": packages[0]["id"]}, {"$set": {"price": 1.0}})
+    initialized_client.portal.call(mock_db.packages.delete_one, {"id": packages[1]["id"]})
+
+    order = initialized_client.post("/api/orders", json={**NEW_ORDER, "package_id": packages[0]["id"]})
+    assert order.status_code == 200
+    assert order.json()["package_price"] == 1.0
+
+    deleted = initialized_client.post("/api/orders", json={**NEW_ORDER, "package_id": packages[1]["id"]})
+    assert deleted.status_code == 404
+
+
+def test_catalog_refresh_picks_up_database_changes(initialized_client, mock_db):
+    package = initialized_client.get("/api/packages").json()[0]
+    initialized_client.portal.call(mock_db.packages.update_one, {"id": package["id"]}, {"$set": {"price": 1.0}})
+
+    initialized_client.portal.call(server.refresh_packages)
+    assert initialized_client.get(f"/api/packages/{package['id']}").json()["price"] == 1.0
+
+
+def test_catalog_refresh_failure_keeps_current_catalog(initialized_client, monkeypatch, caplog):
+    before = initialized_client.get("/api/packages").json()
+
+    async def failing_load():
+        raise RuntimeError("mongo indisponível")
+
+    monkeypatch.setattr(server, "load_packages", failing_load)
+    initialized_client.portal.call(server.refresh_packages)
+
+    response = initialized_client.get("/api/packages")
+    assert response.status_code == 200
+    assert response.json() == before
+    assert initialized_client.get(f"/api/packages/{before[0]['id']}").status_code == 200
+    assert "Falha ao recarregar o catálogo de pacotes" in caplog.text
+
+
+def test_packages_returns_etag_and_304_on_match(initialized_client):
+    response = initialized_client.get("/api/packages")
+    assert response.status_code == 200
+    assert len(response.json()) == 5
+    etag = response.headers["etag"]
+
+    cached = initialized_client.get("/api/packages", headers={"If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["etag"] == etag
+    assert cached.content == b""
+
+    weak = initialized_client.get("/api/packages", headers={"If-None-Match": f'"other", W/{etag}'})
+    assert weak.status_code == 304
+
+    stale = initialized_client.get("/api/packages", headers={"If-None-Match": '"other"'})
+    assert stale.status_code == 200
+
+
+def test_packages_etag_changes_after_each_write(initialized_client):
+    etags = [initialized_client.get("/api/packages").headers["etag"]]
+
+    created = initialized_client.post("/api/packages", json=NEW_PACKAGE).json()
+    listing = initialized_client.get("/api/packages")
+    etags.append(listing.headers["etag"])
+    assert created["id"] in [package["id"] for package in listing.json()]
+
+    initialized_client.put(f"/api/packages/{created['id']}", json={**NEW_PACKAGE, "price": 5.90})
+    listing = initialized_client.get("/api/packages")
+    etags.append(listing.headers["etag"])
+    assert [p["price"] for p in listing.json() if p["id"] == created["id"]] == [5.90]
+
+    initialized_client.delete(f"/api/packages/{created['id']}")
+    listing = initialized_client.get("/api/packages")
+    etags.append(listing.headers["etag"])
+    assert created["id"] not in [package["id"] for package in listing.json()]
+
+    assert all(previous != current for previous, current in zip(etags, etags[1:]))
+    stale = initialized_client.get("/api/packages", headers={"If-None-Match": etags[2]})
+    assert stale.status_code == 200
+
+
+def test_stats_on_empty_collection(client):
+    assert client.get("/api/admin/stats").json() == {
+        "total_orders": 0,
+        "pending_orders": 0,
+        "completed_orders": 0,
+        "total_revenue": 0,
+    }
+
+
+def test_stats_counts_orders_by_status(initialized_client):
+    packages = initialized_client.get("/api/packages").json()
+    order_ids = [
+        initialized_client.post("/api/orders", json={**NEW_ORDER, "package_id": package["id"]}).json()["id"]
+        for package in packages[:3]
+    ]
+    initialized_client.put(f"/api/orders/{order_ids[0]}/status", json={"status": "paid"})
+    initialized_client.put(f"/api/orders/{order_ids[1]}/status", json={"status": "completed"})
+
+    stats = initialized_client.get("/api/admin/stats").json()
+    assert stats["total_orders"] == 3
+    assert stats["pending_orders"] == 1
+    assert stats["completed_orders"] == 1
+    assert stats["total_revenue"] == packages[0]["price"] + packages[1]["price"]
+
+
+def test_timestamps_use_same_format_across_endpoints(initialized_client):
+    package = initialized_client.get("/api/packages").json()[0]
+    order = initialized_client.post("/api/orders", json={**NEW_ORDER, "package_id": package["id"]}).json()
+    listed = initialized_client.get("/api/orders").json()[0]
+    fetched = initialized_client.get(f"/api/orders/{order['id']}").json()
+
+    for timestamp in (package["created_at"], order["created_at"], listed["created_at"], fetched["created_at"]):
+        assert timestamp.endswith("Z")
+
+
+def test_update_package_outside_catalog_uses_database(initialized_client):
+    created = initialized_client.post("/api/packages", json=NEW_PACKAGE).json()
+    server._packages.pop(created["id"])
+
+    response = initialized_client.put(f"/api/packages/{created['id']}", json={**NEW_PACKAGE, "price": 7.0})
+    assert response.status_code == 200
+    assert response.json()["price"] == 7.0
+    assert server._packages[created["id"]]["price"] == 7.0
+
+
+def test_update_missing_package_returns_404(initialized_client):
+    assert initialized_client.put("/api/packages/missing", json=NEW_PACKAGE).status_code == 404
+    assert None not in initialized_client.get("/api/packages").json()
+
+
+def test_update_package_deleted_elsewhere_returns_404(initialized_client, mock_db):
+    package = initialized_client.get("/api/packages").json()[0]
+    initialized_client.portal.call(mock_db.packages.delete_one, {"id": package["id"]})
+
+    response = initialized_client.put(f"/api/packages/{package['id']}", json=NEW_PACKAGE)
+    assert response.status_code == 404
+    assert package["id"] not in [p["id"] for p in initialized_client.get("/api/packages").json()]
+
+
+def test_missing_order_returns_404(initialized_client):
+    assert initialized_client.get("/api/orders/missing").status_code == 404
+    response = initialized_client.put("/api/orders/missing/status", json={"status": "paid"})
+    assert response.status_code == 404
+
+
+def test_init_data_is_idempotent(client):
+    assert client.post("/api/init-data").json()["message"].startswith("Inicializados")
+    first_ids = sorted(package["id"] for package in client.get("/api/packages").json())
+
+    assert client.post("/api/init-data").json() == {"message": "Dados já inicializados"}
+    assert sorted(package["id"] for package in client.get("/api/packages").json()) == first_ids
+
+
+def _fail_insert_many(monkeypatch, mock_db, details):
+    async def failing_insert_many(*args, **kwargs):
+        raise BulkWriteError(details)
+
+    async def no_packages(*args, **kwargs):
+        return 0
+
+    collection = mock_db.packages
+    monkeypatch.setattr(collection, "insert_many", failing_insert_many)
+    monkeypatch.setattr(collection, "count_documents", no_packages)
+    monkeypatch.setattr(mock_db, "packages", collection, raising=False)
+
+
+def test_init_data_race_on_duplicate_keys_reports_initialized(client, mock_db, monkeypatch):
+    _fail_insert_many(monkeypatch, mock_db, {"writeErrors": [{"code": 11000}], "writeConcernErrors": []})
+    assert client.post("/api/init-data").json() == {"message": "Dados já inicializados"}
+
+
+@pytest.mark.parametrize("details", [
+    {"writeErrors": [], "writeConcernErrors": [{"code": 64}]},
+    {"writeErrors": [{"code": 11000}], "writeConcernErrors": [{"code": 64}]},
+    {"writeErrors": [{"code": 11000}, {"code": 121}], "writeConcernErrors": []},
+])
+def test_init_data_reraises_other_write_errors(client, mock_db, monkeypatch, details):
+    _fail_insert_many(monkeypatch, mock_db, details)
+    with pytest.raises(BulkWriteError):
+        client.post("/api/init-data")